@@ -10,9 +10,16 @@ to the remote VPS MQTT broker with realistic network impairments:
 """
 
 import argparse
-import json
+import ctypes
+import errno
+import heapq
+import itertools
+import os
 import random
+import re
+import selectors
 import socket
+import sys
 import threading
 import time
 
@@ -31,6 +38,129 @@ MAX_JITTER_S = 0.5        # up to 500 ms jitter
 OOO_PROBABILITY = 0.01    # 1 % chance of out-of-order (extra delay)
 OOO_EXTRA_S = 1.0          # extra delay when OOO triggers
 
+# Probability tests as integer cutoffs: getrandbits(20) < cutoff is a pure
+# int compare, no float draw needed for the common reject case.
+_RAND_BITS = 20
+_DROP_CUTOFF = int(DROP_RATE * (1 << _RAND_BITS))
+_OOO_CUTOFF = int(OOO_PROBABILITY * (1 << _RAND_BITS))
+
+# One RNG per thread — the module-level random functions all serialize on a
+# single shared Mersenne Twister instance.
+_tls = threading.local()
+
+
+def _thread_rng() -> random.Random:
+    rng = getattr(_tls, "rng", None)
+    if rng is None:
+        rng = _tls.rng = random.Random()
+    return rng
+
+
+# ---------------------------------------------------------------------------
+# CPU pinning (opt-in, Linux only)
+# ---------------------------------------------------------------------------
+_SO_INCOMING_CPU = getattr(socket, "SO_INCOMING_CPU", 49)  # Linux value
+
+
+def pin_current_thread(core: int):
+    """Pin the calling thread to one CPU core; warn-and-continue elsewhere."""
+    try:
+        os.sched_setaffinity(0, {core})
+    except (AttributeError, OSError) as exc:
+        print(f"[hub] ⚠ could not pin thread to core {core}: {exc}")
+
+
+def set_realtime_priority(priority: int = 10):
+    """Give the calling thread SCHED_FIFO priority (needs CAP_SYS_NICE)."""
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (AttributeError, OSError, PermissionError) as exc:
+        print(f"[hub] ⚠ could not set SCHED_FIFO: {exc}")
+
+
+# ---------------------------------------------------------------------------
+# Batched UDP receive
+# ---------------------------------------------------------------------------
+RECV_BATCH = 64           # datagrams per recvmmsg() call
+RECV_BUF_SIZE = 4096      # per-datagram buffer
+MAX_BATCHES_PER_WAKEUP = 8  # drain cap so one burst can't starve the loop
+
+MSG_DONTWAIT = 0x40       # not exposed by the socket module on all platforms
+
+
+def _make_recvmmsg_batcher(n: int, buf_size: int):
+    """Build a recvmmsg(2)-based batch receiver, or return None if unavailable.
+
+    The returned callable is bound to preallocated buffers and is therefore
+    NOT reentrant — it must only ever be called from the single receive loop.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        libc.recvmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+
+    class Iovec(ctypes.Structure):
+        _fields_ = [("iov_base", ctypes.c_void_p),
+                    ("iov_len", ctypes.c_size_t)]
+
+    class Msghdr(ctypes.Structure):
+        _fields_ = [("msg_name", ctypes.c_void_p),
+                    ("msg_namelen", ctypes.c_uint),
+                    ("msg_iov", ctypes.POINTER(Iovec)),
+                    ("msg_iovlen", ctypes.c_size_t),
+                    ("msg_control", ctypes.c_void_p),
+                    ("msg_controllen", ctypes.c_size_t),
+                    ("msg_flags", ctypes.c_int)]
+
+    class Mmsghdr(ctypes.Structure):
+        _fields_ = [("msg_hdr", Msghdr),
+                    ("msg_len", ctypes.c_uint)]
+
+    # One 4 KB buffer + iovec per slot, filled in place on every call.
+    bufs = [ctypes.create_string_buffer(buf_size) for _ in range(n)]
+    iovecs = (Iovec * n)()
+    hdrs = (Mmsghdr * n)()
+    for i in range(n):
+        iovecs[i].iov_base = ctypes.cast(bufs[i], ctypes.c_void_p)
+        iovecs[i].iov_len = buf_size
+        hdrs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+        hdrs[i].msg_hdr.msg_iovlen = 1
+
+    def recv(fd: int) -> list:
+        got = libc.recvmmsg(fd, hdrs, n, MSG_DONTWAIT, None)
+        if got < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, "recvmmsg failed")
+        return [bufs[i].raw[:hdrs[i].msg_len] for i in range(got)]
+
+    return recv
+
+
+_recvmmsg_batch = _make_recvmmsg_batcher(RECV_BATCH, RECV_BUF_SIZE)
+
+
+def recv_batch(sock: socket.socket, n: int = RECV_BATCH) -> list:
+    """Drain up to *n* datagrams from a non-blocking *sock* in one go.
+
+    Uses recvmmsg(2) on Linux (one syscall for the whole batch); elsewhere
+    falls back to a recvfrom() loop that stops at EWOULDBLOCK.
+    """
+    if _recvmmsg_batch is not None:
+        return _recvmmsg_batch(sock.fileno())
+    out = []
+    while len(out) < n:
+        try:
+            data, _addr = sock.recvfrom(RECV_BUF_SIZE)
+        except BlockingIOError:
+            break
+        out.append(data)
+    return out
+
 
 # ---------------------------------------------------------------------------
 # MQTT helper
@@ -78,58 +208,150 @@ class MQTTForwarder:
         self.client.disconnect()
 
 
+# ---------------------------------------------------------------------------
+# Delayed-publish scheduler
+# ---------------------------------------------------------------------------
+class DelayScheduler:
+    """One thread draining a min-heap of (deadline, callback) entries.
+
+    Replaces one threading.Timer (= one OS thread) per delayed packet with a
+    single long-lived worker, so delaying a packet is just a heap push.
+    """
+
+    def __init__(self, core: int | None = None):
+        self._heap: list = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()  # tie-breaker; callbacks don't compare
+        self._stopped = False
+        self._core = core
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="hub-scheduler")
+
+    def start(self):
+        self._thread.start()
+
+    def schedule(self, delay_s: float, callback):
+        """Run *callback* after *delay_s* seconds on the scheduler thread."""
+        deadline = time.monotonic() + delay_s
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._seq), callback))
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self):
+        if self._core is not None:
+            pin_current_thread(self._core)
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout=timeout)
+                if self._stopped:
+                    return
+                due = []
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[2])
+            # Run callbacks outside the lock so schedule() never blocks on us.
+            for callback in due:
+                callback()
+
+
 # ---------------------------------------------------------------------------
 # Impairment + forwarding
 # ---------------------------------------------------------------------------
-def forward_with_impairments(forwarder: MQTTForwarder, raw: bytes, stats: dict):
+class Stats:
+    """Forwarding counters — fixed slots, so bumps are attribute ops rather
+    than dict hashing on the per-packet path."""
+
+    __slots__ = ("received", "forwarded", "dropped", "ooo", "pub_fail")
+
+    def __init__(self):
+        self.received = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self.ooo = 0
+        self.pub_fail = 0
+
+
+# The hub never inspects the payload beyond the sensor_id it needs for the
+# topic, so a byte scan beats a full json.loads() per packet.
+_SENSOR_ID_RE = re.compile(rb'"sensor_id"\s*:\s*"([^"]+)"')
+
+
+def _extract_sensor_id(raw: bytes) -> bytes:
+    m = _SENSOR_ID_RE.search(raw)
+    return m.group(1) if m else b"unknown"
+
+
+# Topic per sensor_id is deterministic — memoize the bytes→str build so the
+# hot path does one dict lookup instead of a concat + decode per packet.
+_topic_cache: dict = {}
+
+
+def _topic_for(sensor_id: bytes) -> str:
+    topic = _topic_cache.get(sensor_id)
+    if topic is None:
+        topic = (b"irrigation/raw/" + sensor_id).decode("utf-8", "replace")
+        _topic_cache[sensor_id] = topic
+    return topic
+
+
+def forward_with_impairments(forwarder: MQTTForwarder, raw: bytes, stats: Stats,
+                             scheduler: DelayScheduler):
     """Apply drop / jitter / OOO and then publish via MQTT."""
-    stats["received"] += 1
+    stats.received += 1
+    rng = _thread_rng()
 
     # --- drop ---
-    if random.random() < DROP_RATE:
-        stats["dropped"] += 1
+    if rng.getrandbits(_RAND_BITS) < _DROP_CUTOFF:
+        stats.dropped += 1
         return
 
     # --- jitter / delay ---
-    delay = random.uniform(0, MAX_JITTER_S)
+    delay = rng.random() * MAX_JITTER_S
 
     # --- out-of-order (extra delay) ---
-    if random.random() < OOO_PROBABILITY:
+    if rng.getrandbits(_RAND_BITS) < _OOO_CUTOFF:
         delay += OOO_EXTRA_S
-        stats["ooo"] += 1
+        stats.ooo += 1
 
     def _do_publish():
         try:
-            msg = json.loads(raw)
-            sensor_id = msg.get("sensor_id", "unknown")
-            topic = f"irrigation/raw/{sensor_id}"
+            topic = _topic_for(_extract_sensor_id(raw))
             ok = forwarder.publish(topic, raw)
             if ok:
-                stats["forwarded"] += 1
+                stats.forwarded += 1
             else:
-                stats["pub_fail"] = stats.get("pub_fail", 0) + 1
+                stats.pub_fail += 1
         except Exception as exc:
             print(f"[hub] publish error: {exc}")
 
     if delay < 0.005:
         _do_publish()
     else:
-        t = threading.Timer(delay, _do_publish)
-        t.daemon = True
-        t.start()
+        scheduler.schedule(delay, _do_publish)
 
 
 # ---------------------------------------------------------------------------
 # Stats printer
 # ---------------------------------------------------------------------------
-def stats_printer(stats: dict, stop_event: threading.Event):
+def stats_printer(stats: Stats, stop_event: threading.Event):
     """Print forwarding stats every 5 seconds."""
     while not stop_event.is_set():
         time.sleep(5)
-        pf = stats.get("pub_fail", 0)
         print(
-            f"[hub] stats | recv={stats['received']}  fwd={stats['forwarded']}  "
-            f"drop={stats['dropped']}  ooo={stats['ooo']}  pub_fail={pf}"
+            f"[hub] stats | recv={stats.received}  fwd={stats.forwarded}  "
+            f"drop={stats.dropped}  ooo={stats.ooo}  pub_fail={stats.pub_fail}"
         )
 
 
@@ -146,11 +368,30 @@ def main():
                         help="MQTT broker host (default: 158.69.206.50)")
     parser.add_argument("--broker-port", type=int, default=1883,
                         help="MQTT broker port (default: 1883)")
+    parser.add_argument("--rcvbuf", type=int, default=8 * 1024 * 1024,
+                        help="UDP SO_RCVBUF size in bytes (default: 8 MiB)")
+    parser.add_argument("--pin-rx-core", type=int, default=None,
+                        help="pin the UDP receive loop to this CPU core "
+                             "(also requests SCHED_FIFO; Linux only)")
+    parser.add_argument("--pin-mqtt-core", type=int, default=None,
+                        help="pin the MQTT network and scheduler threads "
+                             "to this CPU core (Linux only)")
     args = parser.parse_args()
 
     # ---- MQTT ----
     forwarder = MQTTForwarder(args.broker, args.broker_port)
-    forwarder.connect()
+    if args.pin_mqtt_core is not None and hasattr(os, "sched_getaffinity"):
+        # Threads inherit affinity from their creator: pin, start paho's
+        # network thread, then restore the original mask for this thread.
+        orig_mask = os.sched_getaffinity(0)
+        pin_current_thread(args.pin_mqtt_core)
+        forwarder.connect()
+        os.sched_setaffinity(0, orig_mask)
+    else:
+        if args.pin_mqtt_core is not None:
+            print(f"[hub] ⚠ could not pin MQTT thread to core "
+                  f"{args.pin_mqtt_core}: unsupported on this platform")
+        forwarder.connect()
 
     # Wait briefly for connection
     time.sleep(2)
@@ -158,28 +399,66 @@ def main():
     # ---- UDP listener ----
     udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Large receive buffer so bursts from many sensors queue in the kernel
+    # instead of being dropped (Linux default is only ~208 KB). Linux clamps
+    # oversized requests silently but macOS raises (ENOBUFS above
+    # kern.ipc.maxsockbuf), so keep going with the platform default.
+    try:
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.rcvbuf)
+    except OSError as exc:
+        print(f"[hub] ⚠ could not set SO_RCVBUF to {args.rcvbuf}: {exc}")
+    # SO_REUSEPORT lets several hub processes share one port for load
+    # spreading; not available everywhere (e.g. older Windows).
+    if hasattr(socket, "SO_REUSEPORT"):
+        try:
+            udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except OSError:
+            pass
     udp_sock.bind((args.udp_host, args.udp_port))
-    udp_sock.settimeout(1.0)
+    udp_sock.setblocking(False)
 
     print(f"[hub] Listening for sensor UDP on {args.udp_host}:{args.udp_port}")
 
-    stats = {"received": 0, "forwarded": 0, "dropped": 0, "ooo": 0}
+    stats = Stats()
     stop = threading.Event()
 
+    # Scheduler publishes via MQTT, so co-locate it with the MQTT thread
+    scheduler = DelayScheduler(core=args.pin_mqtt_core)
+    scheduler.start()
+
+    if args.pin_rx_core is not None:
+        pin_current_thread(args.pin_rx_core)
+        set_realtime_priority()
+        # Steer softirq delivery for this socket to the same core
+        try:
+            udp_sock.setsockopt(socket.SOL_SOCKET, _SO_INCOMING_CPU,
+                                args.pin_rx_core)
+        except OSError:
+            pass
+
     st = threading.Thread(target=stats_printer, args=(stats, stop), daemon=True)
     st.start()
 
+    sel = selectors.DefaultSelector()
+    sel.register(udp_sock, selectors.EVENT_READ)
+
     try:
         while True:
-            try:
-                data, addr = udp_sock.recvfrom(4096)
-            except socket.timeout:
+            if not sel.select(timeout=1.0):
                 continue
-            forward_with_impairments(forwarder, data, stats)
+            # Drain the socket to empty (bounded) before polling again
+            for _ in range(MAX_BATCHES_PER_WAKEUP):
+                batch = recv_batch(udp_sock)
+                if not batch:
+                    break
+                for raw in batch:
+                    forward_with_impairments(forwarder, raw, stats, scheduler)
     except KeyboardInterrupt:
         print("\n[hub] Shutting down …")
         stop.set()
+        scheduler.stop()
         forwarder.stop()
+        sel.close()
         udp_sock.close()
         print("[hub] Done.")
 
@@ -13,106 +13,288 @@ Sends JSON packets over UDP to the local hub.
 """
 
 import argparse
+import asyncio
+import ctypes
 import json
-import math
 import random
+import re
 import socket
+import sys
 import threading
 import time
 
+try:
+    import numpy as np
+except ImportError:
+    print("ERROR: numpy is required.  pip install numpy")
+    raise SystemExit(1)
+
 try:
     import paho.mqtt.client as mqtt
 except ImportError:
     mqtt = None  # MQTT command channel is optional
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads  # fall back to stdlib json
+
 
 # ---------------------------------------------------------------------------
 # Sensor model
 # ---------------------------------------------------------------------------
-class VirtualSensor:
-    """Simulates one soil-moisture sensor."""
-
-    def __init__(self, sensor_id: str, baseline: float = 500.0):
-        self.sensor_id = sensor_id
-        self.baseline = baseline
-        self.moisture = baseline
-
-        # Noise parameters
-        self.noise_std = 3.0            # Gaussian noise σ  (was 4.0)
-        self.spike_prob = 0.015         # probability of an outlier per tick
-        self.spike_mag = (60.0, 150.0)  # outlier magnitude range (was 80–200)
-
-        # Drift
-        self.drift_rate = 0.0           # units / sec (set randomly)
-        self._randomise_drift()
-
-        # Irrigation event state
-        self.irr_amplitude = 0.0
-        self.irr_tau = 60.0             # decay time-constant (seconds)
-        self.irr_prob = 0.005           # probability of triggering irrigation per tick (was 0.003)
-
+# Ids are embedded verbatim in pre-encoded JSON, the hub's byte-scan and MQTT
+# topic segments — restrict them to characters that are safe in all three.
+_SENSOR_ID_RE = re.compile(r"[A-Za-z0-9_.-]+")
+
+
+class SensorFleet:
+    """Simulates N soil-moisture sensors with struct-of-arrays state.
+
+    All per-sensor state lives in parallel float32 arrays so one tick()
+    advances the whole fleet with a handful of NumPy vector ops instead of
+    N passes through the Python interpreter.
+    """
+
+    # Noise / event parameters (shared by all sensors)
+    NOISE_STD = 3.0             # Gaussian noise σ  (was 4.0)
+    SPIKE_PROB = 0.015          # probability of an outlier per tick
+    SPIKE_MAG = (60.0, 150.0)   # outlier magnitude range (was 80–200)
+    IRR_TAU = 60.0              # irrigation decay time-constant (seconds)
+    IRR_PROB = 0.005            # probability of irrigation per tick (was 0.003)
+
+    def __init__(self):
+        self.sensor_ids: list[str] = []
+        self._index: dict[str, int] = {}  # sensor_id → array position
+        # Immutable JSON head per sensor, pre-encoded once at add() time
+        self._prefixes: list[bytes] = []
+        self.baseline = np.empty(0, dtype=np.float32)
+        self.moisture = np.empty(0, dtype=np.float32)
+        self.drift_rate = np.empty(0, dtype=np.float32)
+        self.irr_amplitude = np.empty(0, dtype=np.float32)
+        self.battery_v = np.empty(0, dtype=np.float32)
+        self.temp_c = np.empty(0, dtype=np.float32)
+        self.rng = np.random.default_rng()
+        # add() runs on the MQTT command thread while tick() runs on the
+        # fleet loop — guard the array reallocations.
+        self._lock = threading.Lock()
+        # exp(-dt/τ) is constant for a fixed tick interval — cache per dt
+        self._decay_dt: float | None = None
+        self._decay = np.float32(1.0)
+
+    @property
+    def n(self) -> int:
+        return len(self.sensor_ids)
+
+    def __contains__(self, sensor_id: str) -> bool:
+        return sensor_id in self._index
+
+    def _add_locked(self, sensor_id: str, baseline: float) -> int:
+        self._index[sensor_id] = len(self.sensor_ids)
+        self.sensor_ids.append(sensor_id)
+        self._prefixes.append(f'{{"sensor_id":"{sensor_id}",'.encode())
+        f32 = np.float32
+        self.baseline = np.append(self.baseline, f32(baseline))
+        self.moisture = np.append(self.moisture, f32(baseline))
+        # Slow random drift direction (gentler than the original ±0.5)
+        self.drift_rate = np.append(self.drift_rate, f32(random.uniform(-0.15, 0.15)))
+        self.irr_amplitude = np.append(self.irr_amplitude, f32(0.0))
         # Battery / temperature (cosmetic)
-        self.battery_v = round(random.uniform(3.6, 4.2), 2)
-        self.temp_c = round(random.uniform(18.0, 30.0), 1)
+        self.battery_v = np.append(self.battery_v, f32(round(random.uniform(3.6, 4.2), 2)))
+        self.temp_c = np.append(self.temp_c, f32(round(random.uniform(18.0, 30.0), 1)))
+        return self.n - 1
+
+    def add(self, sensor_id: str, baseline: float = 500.0) -> int:
+        """Add one sensor to the fleet and return its index.
+
+        Raises ValueError for ids that would break the JSON templates or
+        the MQTT topic they end up in.
+        """
+        if not _SENSOR_ID_RE.fullmatch(sensor_id):
+            raise ValueError(f"invalid sensor_id: {sensor_id!r} "
+                             "(allowed: letters, digits, '_', '.', '-')")
+        with self._lock:
+            return self._add_locked(sensor_id, baseline)
+
+    def tick(self, dt: float) -> list[dict]:
+        """Advance every sensor by *dt* seconds and return their readings."""
+        with self._lock:
+            raw, ts = self._advance_locked(dt)
+            return [
+                {
+                    "sensor_id": sid,
+                    "ts": ts,
+                    "moisture_raw": round(float(raw[i]), 2),
+                    "battery_v": round(float(self.battery_v[i]), 2),
+                    "temp_c": round(float(self.temp_c[i]), 1),
+                }
+                for i, sid in enumerate(self.sensor_ids)
+            ]
+
+    def tick_payloads(self, dt: float) -> list[bytes]:
+        """Advance every sensor by *dt* seconds and return encoded packets.
+
+        Skips the dict + JSON-encoder round trip: the immutable head of each
+        packet is pre-encoded and the changing fields are spliced in with
+        bytes %-formatting.
+        """
+        with self._lock:
+            raw, ts = self._advance_locked(dt)
+            mid = b'"ts":%.3f,"moisture_raw":' % ts
+            tail = b'%.2f,"battery_v":%.2f,"temp_c":%.1f}'
+            battery_v = self.battery_v
+            temp_c = self.temp_c
+            return [
+                prefix + mid + tail % (raw[i], battery_v[i], temp_c[i])
+                for i, prefix in enumerate(self._prefixes)
+            ]
+
+    def _advance_locked(self, dt: float):
+        n = self.n
+        if n == 0:
+            return np.empty(0, dtype=np.float32), 0.0
+        rng = self.rng
 
-    # --- helpers -----------------------------------------------------------
-    def _randomise_drift(self):
-        """Pick a slow random drift direction."""
-        self.drift_rate = random.uniform(-0.15, 0.15)  # gentler (was ±0.5)
-
-    def tick(self, dt: float) -> dict:
-        """Advance the sensor by *dt* seconds and return a reading."""
         # Drift
         self.moisture += self.drift_rate * dt
 
-        # Irrigation event — step up + exponential decay
-        if random.random() < self.irr_prob:
-            self.irr_amplitude += random.uniform(80, 150)
-        if self.irr_amplitude > 0.1:
-            self.moisture += self.irr_amplitude * (1 - math.exp(-dt / self.irr_tau))
-            self.irr_amplitude *= math.exp(-dt / self.irr_tau)
+        # Irrigation events — step up + exponential decay
+        irr_mask = rng.random(n) < self.IRR_PROB
+        hits = int(irr_mask.sum())
+        if hits:
+            self.irr_amplitude[irr_mask] += rng.uniform(80, 150, hits).astype(np.float32)
+        if dt != self._decay_dt:
+            self._decay = np.float32(np.exp(-dt / self.IRR_TAU))
+            self._decay_dt = dt
+        decay = self._decay
+        active = self.irr_amplitude > 0.1
+        self.moisture[active] += self.irr_amplitude[active] * (1 - decay)
+        self.irr_amplitude[active] *= decay
 
         # Gaussian noise
-        noise = random.gauss(0, self.noise_std)
+        noise = rng.standard_normal(n, dtype=np.float32) * self.NOISE_STD
 
-        # Occasional spike
-        spike = 0.0
-        if random.random() < self.spike_prob:
-            spike = random.choice([-1, 1]) * random.uniform(*self.spike_mag)
+        # Occasional spikes
+        spike = np.zeros(n, dtype=np.float32)
+        spike_mask = rng.random(n) < self.SPIKE_PROB
+        hits = int(spike_mask.sum())
+        if hits:
+            sign = np.where(rng.random(hits) < 0.5, -1.0, 1.0)
+            spike[spike_mask] = (sign * rng.uniform(*self.SPIKE_MAG, hits)).astype(np.float32)
 
         raw = self.moisture + noise + spike
 
-        # Battery drain (very slow)
-        self.battery_v = max(3.0, self.battery_v - random.uniform(0, 0.0001))
+        # Battery drain (very slow) and temperature wander
+        self.battery_v = np.maximum(
+            np.float32(3.0), self.battery_v - rng.uniform(0, 0.0001, n).astype(np.float32))
+        self.temp_c += rng.uniform(-0.05, 0.05, n).astype(np.float32)
+
+        return raw, round(time.time(), 3)
+
+
+class VirtualSensor:
+    """One soil-moisture sensor — compatibility shim over a 1-element fleet."""
+
+    def __init__(self, sensor_id: str, baseline: float = 500.0):
+        self.sensor_id = sensor_id
+        self._fleet = SensorFleet()
+        self._fleet.add(sensor_id, baseline)
+
+    def tick(self, dt: float) -> dict:
+        """Advance the sensor by *dt* seconds and return a reading."""
+        return self._fleet.tick(dt)[0]
 
-        # Temperature wander
-        self.temp_c += random.uniform(-0.05, 0.05)
 
-        return {
-            "sensor_id": self.sensor_id,
-            "ts": round(time.time(), 3),
-            "moisture_raw": round(raw, 2),
-            "battery_v": round(self.battery_v, 2),
-            "temp_c": round(self.temp_c, 1),
-        }
+# ---------------------------------------------------------------------------
+# Batched UDP send
+# ---------------------------------------------------------------------------
+def _make_sendmmsg_batcher():
+    """Build a sendmmsg(2)-based batch sender, or return None if unavailable."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        libc.sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+
+    class Iovec(ctypes.Structure):
+        _fields_ = [("iov_base", ctypes.c_void_p),
+                    ("iov_len", ctypes.c_size_t)]
+
+    class Msghdr(ctypes.Structure):
+        _fields_ = [("msg_name", ctypes.c_void_p),
+                    ("msg_namelen", ctypes.c_uint),
+                    ("msg_iov", ctypes.POINTER(Iovec)),
+                    ("msg_iovlen", ctypes.c_size_t),
+                    ("msg_control", ctypes.c_void_p),
+                    ("msg_controllen", ctypes.c_size_t),
+                    ("msg_flags", ctypes.c_int)]
+
+    class Mmsghdr(ctypes.Structure):
+        _fields_ = [("msg_hdr", Msghdr),
+                    ("msg_len", ctypes.c_uint)]
+
+    def send(fd: int, payloads: list) -> int:
+        n = len(payloads)
+        iovecs = (Iovec * n)()
+        hdrs = (Mmsghdr * n)()
+        for i, payload in enumerate(payloads):
+            # c_char_p points into the bytes object; *payloads* keeps it alive.
+            iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(payload), ctypes.c_void_p)
+            iovecs[i].iov_len = len(payload)
+            hdrs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+            hdrs[i].msg_hdr.msg_iovlen = 1
+        sent = libc.sendmmsg(fd, hdrs, n, 0)
+        if sent < 0:
+            raise OSError(ctypes.get_errno(), "sendmmsg failed")
+        return sent
+
+    return send
+
+
+_sendmmsg_batch = _make_sendmmsg_batcher()
+
+
+def send_batch(sock: socket.socket, payloads: list) -> int:
+    """Send all *payloads* on a connected UDP *sock*, batching where possible.
+
+    One sendmmsg(2) syscall covers the whole fleet tick on Linux; elsewhere
+    this degrades to a plain send() loop.
+    """
+    if not payloads:
+        return 0
+    if _sendmmsg_batch is not None:
+        return _sendmmsg_batch(sock.fileno(), payloads)
+    for payload in payloads:
+        sock.send(payload)
+    return len(payloads)
 
 
 # ---------------------------------------------------------------------------
-# Sensor thread
+# Fleet tick task
 # ---------------------------------------------------------------------------
-def sensor_loop(sensor: VirtualSensor, rate_hz: float,
-                udp_sock: socket.socket, hub_addr: tuple,
-                stop_event: threading.Event):
-    """Run one sensor at *rate_hz* Hz, sending UDP datagrams to *hub_addr*."""
+async def fleet_task(fleet: SensorFleet, rate_hz: float,
+                     udp_sock: socket.socket):
+    """Tick the whole fleet at *rate_hz* Hz, batch-sending each round of
+    readings to the hub the socket is connected to.
+
+    One asyncio task replaces the old thread-per-sensor design entirely;
+    deadlines are absolute (loop.time() based) so the tick rate doesn't
+    drift by the per-tick processing cost.
+    """
     interval = 1.0 / rate_hz
-    while not stop_event.is_set():
-        pkt = sensor.tick(interval)
-        data = json.dumps(pkt).encode()
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while True:
+        payloads = fleet.tick_payloads(interval)
         try:
-            udp_sock.sendto(data, hub_addr)
+            send_batch(udp_sock, payloads)
         except OSError as exc:
-            print(f"[sensor_sim] send error ({sensor.sensor_id}): {exc}")
-        time.sleep(interval)
+            print(f"[sensor_sim] send error: {exc}")
+        next_tick += interval
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
 
 
 # ---------------------------------------------------------------------------
@@ -136,10 +318,15 @@ def main():
 
     hub_addr = (args.hub_host, args.hub_port)
     udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    stop = threading.Event()
+    # Generous send buffer so a burst of per-sensor sends never blocks
+    # (mirrors the hub's SO_RCVBUF tuning; macOS may refuse large sizes)
+    try:
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+    except OSError as exc:
+        print(f"[sensor_sim] ⚠ could not set SO_SNDBUF: {exc}")
+    udp_sock.connect(hub_addr)  # fixed destination → plain send()/sendmmsg()
 
-    sensors = []
-    threads = []
+    fleet = SensorFleet()
     next_sensor_idx = args.num_sensors  # for generating unique IDs
 
     print(f"[sensor_sim] Spawning {args.num_sensors} sensors → hub at {hub_addr}  @ {args.rate} Hz")
@@ -147,24 +334,13 @@ def main():
     for i in range(args.num_sensors):
         sid = f"zone{i:02d}"
         baseline = random.uniform(350, 650)
-        s = VirtualSensor(sensor_id=sid, baseline=baseline)
-        sensors.append(s)
-
-        t = threading.Thread(target=sensor_loop, args=(s, args.rate, udp_sock, hub_addr, stop),
-                             daemon=True, name=f"sensor-{sid}")
-        t.start()
-        threads.append(t)
+        fleet.add(sid, baseline)
 
     # ── MQTT command channel for dynamic sensor creation ──────────────
     def spawn_sensor(sensor_id: str, baseline: float = 500.0):
-        """Create and start a new sensor at runtime."""
+        """Add a new sensor to the running fleet."""
         nonlocal next_sensor_idx
-        s = VirtualSensor(sensor_id=sensor_id, baseline=baseline)
-        sensors.append(s)
-        t = threading.Thread(target=sensor_loop, args=(s, args.rate, udp_sock, hub_addr, stop),
-                             daemon=True, name=f"sensor-{sensor_id}")
-        t.start()
-        threads.append(t)
+        fleet.add(sensor_id, baseline)
         next_sensor_idx += 1
         print(f"[sensor_sim] ✚ Spawned new sensor: {sensor_id} (baseline={baseline:.0f})")
 
@@ -178,8 +354,8 @@ def main():
 
         def on_message(client, userdata, msg):
             try:
-                payload = json.loads(msg.payload)
-            except json.JSONDecodeError:
+                payload = json_loads(msg.payload)
+            except ValueError:
                 return
 
             if msg.topic == "irrigation/command/create":
@@ -187,12 +363,14 @@ def main():
                 if not sid:
                     sid = f"zone{next_sensor_idx:02d}"
                 baseline = payload.get("baseline", random.uniform(350, 650))
-                # Don't create duplicates
-                existing_ids = {s.sensor_id for s in sensors}
-                if sid in existing_ids:
+                # Don't create duplicates — O(1) via the fleet's id index
+                if sid in fleet:
                     print(f"[sensor_sim] Sensor {sid} already exists, skipping")
                     return
-                spawn_sensor(sid, baseline)
+                try:
+                    spawn_sensor(sid, baseline)
+                except ValueError as exc:
+                    print(f"[sensor_sim] Rejected create command: {exc}")
 
         mclient = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
                               client_id="sensor-sim-cmd", protocol=mqtt.MQTTv311)
@@ -204,13 +382,9 @@ def main():
         print("[sensor_sim] ⚠ paho-mqtt not installed — command channel disabled")
 
     try:
-        while True:
-            time.sleep(1)
+        asyncio.run(fleet_task(fleet, args.rate, udp_sock))
     except KeyboardInterrupt:
         print("\n[sensor_sim] Shutting down …")
-        stop.set()
-        for t in threads:
-            t.join(timeout=2)
         udp_sock.close()
         print("[sensor_sim] Done.")
 
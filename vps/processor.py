@@ -19,7 +19,8 @@ import argparse
 import collections
 import json
 import math
-import statistics
+import queue
+import sys
 import threading
 import time
 
@@ -29,6 +30,25 @@ except ImportError:
     print("ERROR: paho-mqtt is required.  pip install paho-mqtt")
     raise SystemExit(1)
 
+try:
+    import numpy as np
+except ImportError:
+    print("ERROR: numpy is required.  pip install numpy")
+    raise SystemExit(1)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # fall back to stdlib json
+
+if orjson is not None:
+    json_dumps = orjson.dumps       # returns bytes
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+    json_loads = json.loads
+
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -52,6 +72,45 @@ MOISTURE_OVERWATER = 650.0
 
 HEALTH_SUMMARY_INTERVAL_S = 5.0  # print summary every N seconds
 
+PROCESS_BATCH_MAX = 256      # max packets drained per worker wakeup
+
+LOG_BATCH_MAX = 64           # max lines coalesced into one stdout write
+LOG_FLUSH_INTERVAL_S = 0.05  # max time a line sits buffered
+
+
+# ---------------------------------------------------------------------------
+# Buffered logger
+# ---------------------------------------------------------------------------
+class BufferedLogger:
+    """Background thread that coalesces log lines into batched stdout writes.
+
+    print() in the processing path holds the stdout lock and can block on a
+    slow terminal/pipe; queueing the line instead keeps I/O off the packet
+    path and amortizes the write() syscalls.
+    """
+
+    def __init__(self):
+        self._q: queue.SimpleQueue = queue.SimpleQueue()
+        threading.Thread(target=self._run, daemon=True,
+                         name="log-writer").start()
+
+    def log(self, line: str):
+        self._q.put(line)
+
+    def _run(self):
+        while True:
+            try:
+                lines = [self._q.get(timeout=LOG_FLUSH_INTERVAL_S)]
+            except queue.Empty:
+                continue
+            while len(lines) < LOG_BATCH_MAX:
+                try:
+                    lines.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            sys.stdout.write("".join(f"{line}\n" for line in lines))
+            sys.stdout.flush()
+
 
 # ---------------------------------------------------------------------------
 # Per-sensor state
@@ -61,8 +120,14 @@ class SensorState:
 
     def __init__(self, sensor_id: str):
         self.sensor_id = sensor_id
-        self.raw_buffer: collections.deque = collections.deque(maxlen=MEDIAN_WINDOW)
-        self.residual_buffer: collections.deque = collections.deque(maxlen=RESIDUAL_WINDOW)
+        # Preallocated ring buffers; _raw_n/_res_n track fill during warm-up
+        self._raw = np.zeros(MEDIAN_WINDOW, dtype=np.float32)
+        self._raw_i = 0
+        self._raw_n = 0
+        self._res = np.zeros(RESIDUAL_WINDOW, dtype=np.float32)
+        self._res_i = 0
+        self._res_n = 0
+        self.last_res_var: float = 0.0
         self.clamp_history: collections.deque = collections.deque(maxlen=SPIKE_CLAMP_WINDOW)
         self.ema: float | None = None
         self.last_filtered: float | None = None
@@ -71,7 +136,7 @@ class SensorState:
         self.total_ooo_dropped: int = 0
 
         # NOISY persistence tracking
-        self.noisy_since: float = 0.0  # wallclock when residual var first exceeded threshold
+        self.noisy_since: float = 0.0  # monotonic time when residual var first exceeded threshold
         self.is_noisy: bool = False
 
     def try_accept(self, ts: float) -> bool:
@@ -81,13 +146,24 @@ class SensorState:
             return False
         return True
 
-    def process(self, raw: float, ts: float) -> dict:
+    def process(self, raw: float, ts: float, now_mono: float | None = None) -> dict:
         self.total_received += 1
         self.last_ts = max(self.last_ts, ts)   # monotonic tracking
-        self.raw_buffer.append(raw)
+        self._raw[self._raw_i] = raw
+        self._raw_i = (self._raw_i + 1) % MEDIAN_WINDOW
+        if self._raw_n < MEDIAN_WINDOW:
+            self._raw_n += 1
 
         # ---- median filter ------------------------------------------------
-        median_val = statistics.median(self.raw_buffer)
+        # Order within the ring is irrelevant; np.partition gives the k-th
+        # order statistic in C for the handful of window elements.
+        window = self._raw[:self._raw_n]
+        k = self._raw_n // 2
+        if self._raw_n % 2:
+            median_val = float(np.partition(window, k)[k])
+        else:
+            part = np.partition(window, [k - 1, k])
+            median_val = float(part[k - 1] + part[k]) / 2
 
         # ---- sanity clamp -------------------------------------------------
         clamped = False
@@ -106,16 +182,23 @@ class SensorState:
 
         # ---- residual-based noise score -----------------------------------
         residual = raw - filtered
-        self.residual_buffer.append(residual)
-        if len(self.residual_buffer) >= 3:
-            res_var = statistics.variance(self.residual_buffer)
+        self._res[self._res_i] = residual
+        self._res_i = (self._res_i + 1) % RESIDUAL_WINDOW
+        if self._res_n < RESIDUAL_WINDOW:
+            self._res_n += 1
+        if self._res_n >= 3:
+            # Sample variance (ddof=1, same as statistics.variance) in C
+            res_var = float(self._res[:self._res_n].var(ddof=1))
             noise_score = round(min(res_var / 500.0, 1.0), 3)  # normalise 0-1
         else:
             res_var = 0.0
             noise_score = 0.0
+        self.last_res_var = res_var
 
         # ---- NOISY with persistence --------------------------------------
-        now = time.time()
+        # Only the elapsed time matters here, so use the monotonic clock;
+        # the caller hoists one reading per batch of packets.
+        now = time.monotonic() if now_mono is None else now_mono
         if res_var > NOISY_RESIDUAL_THRESH:
             if self.noisy_since == 0.0:
                 self.noisy_since = now
@@ -156,20 +239,18 @@ class SensorState:
 # ---------------------------------------------------------------------------
 # Stale-sensor checker + health summary
 # ---------------------------------------------------------------------------
-def check_stale(sensors: dict[str, SensorState]):
+def check_stale(sensors: dict[str, SensorState], now: float):
     """Print warnings for sensors that haven't reported recently."""
-    now = time.time()
     for sid, state in sensors.items():
         gap = now - state.last_ts
         if state.last_ts > 0 and gap > STALE_TIMEOUT_S:
             print(f"  ⚠  [{sid}] STALE — no data for {gap:.1f} s")
 
 
-def print_health_summary(sensors: dict[str, SensorState]):
+def print_health_summary(sensors: dict[str, SensorState], now: float):
     """Print a compact dashboard every few seconds."""
     if not sensors:
         return
-    now = time.time()
     ok = noisy = stale = spiky = 0
     scores = []
     for s in sensors.values():
@@ -182,9 +263,9 @@ def print_health_summary(sensors: dict[str, SensorState]):
             spiky += 1
         else:
             ok += 1
-        # Grab latest noise score from residual buffer
-        if len(s.residual_buffer) >= 3:
-            scores.append(statistics.variance(s.residual_buffer) / 500.0)
+        # Latest noise score, cached by process() — nothing to recompute
+        if s._res_n >= 3:
+            scores.append(s.last_res_var / 500.0)
     avg_noise = round(min(sum(scores) / len(scores), 1.0), 3) if scores else 0.0
     total = len(sensors)
     print(
@@ -193,10 +274,90 @@ def print_health_summary(sensors: dict[str, SensorState]):
     )
 
 
+# ---------------------------------------------------------------------------
+# Processing worker
+# ---------------------------------------------------------------------------
+# Output topic per sensor_id is deterministic — memoize instead of building
+# an f-string per packet.
+_out_topic_cache: dict = {}
+
+
+def _out_topic_for(sensor_id: str) -> str:
+    topic = _out_topic_cache.get(sensor_id)
+    if topic is None:
+        topic = _out_topic_cache[sensor_id] = f"irrigation/processed/{sensor_id}"
+    return topic
+
+
+def process_loop(sensors: dict[str, SensorState],
+                 work_queue: queue.SimpleQueue,
+                 publish_queue: queue.SimpleQueue,
+                 stop_event: threading.Event,
+                 logger: BufferedLogger | None = None):
+    """Drain queued packets in batches and run the per-sensor pipeline.
+
+    Runs on its own thread so the MQTT network thread only parses and
+    enqueues; a burst of packets is worked off up to PROCESS_BATCH_MAX at a
+    time per wakeup. Results are handed to the publisher thread(s) via
+    *publish_queue* rather than published inline.
+    """
+    while not stop_event.is_set():
+        try:
+            batch = [work_queue.get(timeout=0.5)]
+        except queue.Empty:
+            continue
+        while len(batch) < PROCESS_BATCH_MAX:
+            try:
+                batch.append(work_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        now_mono = time.monotonic()  # one clock read for the whole batch
+
+        for sensor_id, raw, ts in batch:
+            # Get or create per-sensor state
+            if sensor_id not in sensors:
+                sensors[sensor_id] = SensorState(sensor_id)
+                print(f"[processor] New sensor discovered: {sensor_id}")
+
+            state = sensors[sensor_id]
+
+            # ---- out-of-order rejection -------------------------------
+            if not state.try_accept(ts):
+                continue  # silently drop stale OOO packet
+
+            result = state.process(raw, ts, now_mono)
+
+            # One encode per packet, shared by log line and publish
+            payload = json_dumps(result)
+
+            # Per-packet console line only in verbose mode
+            if logger is not None:
+                logger.log(f"  → {payload.decode()}")
+
+            # Republish processed (via the publisher thread)
+            publish_queue.put((_out_topic_for(sensor_id), payload))
+
+
+def publisher_loop(client, publish_queue: queue.SimpleQueue,
+                   stop_event: threading.Event):
+    """Drain (topic, payload) pairs and publish them on *client*.
+
+    Decouples processing from paho's producer lock; with several publisher
+    threads the shared queue spreads load across their clients.
+    """
+    while not stop_event.is_set():
+        try:
+            topic, payload = publish_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        client.publish(topic, payload, qos=0)
+
+
 # ---------------------------------------------------------------------------
 # MQTT callbacks
 # ---------------------------------------------------------------------------
-def make_callbacks(sensors: dict[str, SensorState], client_ref: list):
+def make_callbacks(work_queue: queue.SimpleQueue):
     """Return on_connect and on_message closures."""
 
     def on_connect(client, userdata, flags, reason_code, properties=None):
@@ -209,8 +370,8 @@ def make_callbacks(sensors: dict[str, SensorState], client_ref: list):
 
     def on_message(client, userdata, msg):
         try:
-            payload = json.loads(msg.payload)
-        except json.JSONDecodeError:
+            payload = json_loads(msg.payload)
+        except ValueError:
             return
 
         sensor_id = payload.get("sensor_id", "unknown")
@@ -220,25 +381,8 @@ def make_callbacks(sensors: dict[str, SensorState], client_ref: list):
         if raw is None:
             return
 
-        # Get or create per-sensor state
-        if sensor_id not in sensors:
-            sensors[sensor_id] = SensorState(sensor_id)
-            print(f"[processor] New sensor discovered: {sensor_id}")
-
-        state = sensors[sensor_id]
-
-        # ---- out-of-order rejection -----------------------------------
-        if not state.try_accept(float(ts)):
-            return  # silently drop stale OOO packet
-
-        result = state.process(float(raw), float(ts))
-
-        # Print to console
-        print(f"  → {json.dumps(result)}")
-
-        # Republish processed
-        out_topic = f"irrigation/processed/{sensor_id}"
-        client.publish(out_topic, json.dumps(result).encode(), qos=0)
+        # Hand off to the processing worker; keep this thread lean
+        work_queue.put((sensor_id, float(raw), float(ts)))
 
     return on_connect, on_message
 
@@ -252,32 +396,58 @@ def main():
                         help="MQTT broker host (default: 127.0.0.1)")
     parser.add_argument("--broker-port", type=int, default=1883,
                         help="MQTT broker port (default: 1883)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print every processed packet (buffered)")
+    parser.add_argument("--publisher-threads", type=int, default=1,
+                        help="number of MQTT publisher clients (default: 1)")
     args = parser.parse_args()
 
     sensors: dict[str, SensorState] = {}
-    client_ref: list = []
+    work_queue: queue.SimpleQueue = queue.SimpleQueue()
+    publish_queue: queue.SimpleQueue = queue.SimpleQueue()
 
-    on_connect, on_message = make_callbacks(sensors, client_ref)
+    on_connect, on_message = make_callbacks(work_queue)
 
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
                          client_id="processor-001", protocol=mqtt.MQTTv311)
     client.on_connect = on_connect
     client.on_message = on_message
-    client_ref.append(client)
 
     print(f"[processor] Connecting to broker {args.broker}:{args.broker_port} …")
     client.connect(args.broker, args.broker_port, keepalive=60)
 
-    # Periodic stale check + health summary in background
-    import threading
-
     stop = threading.Event()
 
+    # Processing worker — keeps the MQTT network thread enqueue-only
+    logger = BufferedLogger() if args.verbose else None
+    threading.Thread(target=process_loop,
+                     args=(sensors, work_queue, publish_queue, stop, logger),
+                     daemon=True, name="process-loop").start()
+
+    # Publisher thread(s) — one shares the subscriber client; more get
+    # their own connections (processor-pub-001…) fed from the same queue
+    if args.publisher_threads <= 1:
+        pub_clients = [client]
+    else:
+        pub_clients = []
+        for k in range(args.publisher_threads):
+            pc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                             client_id=f"processor-pub-{k + 1:03d}",
+                             protocol=mqtt.MQTTv311)
+            pc.connect(args.broker, args.broker_port, keepalive=60)
+            pc.loop_start()
+            pub_clients.append(pc)
+    for k, pc in enumerate(pub_clients):
+        threading.Thread(target=publisher_loop,
+                         args=(pc, publish_queue, stop),
+                         daemon=True, name=f"publisher-{k}").start()
+
     def monitor_loop():
         while not stop.is_set():
             time.sleep(HEALTH_SUMMARY_INTERVAL_S)
-            check_stale(sensors)
-            print_health_summary(sensors)
+            now = time.time()  # one clock read shared by both passes
+            check_stale(sensors, now)
+            print_health_summary(sensors, now)
 
     threading.Thread(target=monitor_loop, daemon=True).start()
 